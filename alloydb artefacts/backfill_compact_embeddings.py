@@ -0,0 +1,157 @@
+import os
+import sys
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+
+# Find and load the .env file from the backend directory
+# Script is in "alloydb artefacts/", .env is in "backend/" (sibling directories)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+backend_dir = os.path.join(project_root, 'backend')
+dotenv_path = os.path.join(backend_dir, '.env')
+print(f"Loading environment from: {dotenv_path}")
+load_dotenv(dotenv_path=dotenv_path)
+
+# Share the column/SQL definitions with the backend so both always agree
+sys.path.insert(0, backend_dir)
+from compact_embeddings import (  # noqa: E402
+    CompactConfig, TEXT_COLUMN, IMAGE_COLUMN,
+    setup_statements, backfill_statement, full_score_expr, search_settings_sql, two_stage_search_sql,
+)
+
+# Queries used for the recall report (override with --query)
+DEFAULT_QUERIES = [
+    "a quiet place to study near the university",
+    "modern apartment for a professional working in the city",
+    "I want to live near the water",
+    "cozy chalet with mountain views",
+    "spacious family home with a garden",
+    "minimalist loft with lots of natural light",
+]
+
+def get_db_connection():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "postgres"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD"),
+        host="127.0.0.1", # Uses your running Auth Proxy
+        port="5432"
+    )
+
+def setup(conn, config):
+    """Creates the shadow columns, the sync trigger and the compact indexes."""
+    print(f"🛠️  Ensuring compact columns: {TEXT_COLUMN} {config.column_type(config.text_dim)}, "
+          f"{IMAGE_COLUMN} {config.column_type(config.image_dim)}")
+    cursor = conn.cursor()
+    for statement in setup_statements(config):
+        cursor.execute(statement)
+    conn.commit()
+    cursor.close()
+    print("✅ Schema ready (columns, trigger, indexes).")
+
+def backfill(conn, config, batch_size):
+    """Populates shadow columns for existing rows in id-ordered batches."""
+    cursor = conn.cursor()
+    sql = backfill_statement(config)
+    last_id, total = 0, 0
+    while True:
+        cursor.execute(sql, (last_id, batch_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        if not ids:
+            break
+        total += len(ids)
+        last_id = max(ids)
+        print(f"  ... {total} rows backfilled (last id: {last_id})")
+    cursor.close()
+    print(f"✅ Backfill complete: {total} rows updated.")
+
+def storage_report(conn):
+    """Average on-disk size per row of the full vs. compact columns."""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT avg(pg_column_size(description_embedding)), avg(pg_column_size({TEXT_COLUMN})),
+               avg(pg_column_size(image_embedding)), avg(pg_column_size({IMAGE_COLUMN}))
+        FROM "search".property_listings
+    """)
+    desc_full, desc_compact, img_full, img_compact = [float(v or 0) for v in cursor.fetchone()]
+    cursor.close()
+    full, compact = desc_full + img_full, desc_compact + img_compact
+    print("\n📦 Storage per row (bytes, avg)")
+    print(f"  description: {desc_full:>8.0f} -> {desc_compact:>8.0f}")
+    print(f"  image:       {img_full:>8.0f} -> {img_compact:>8.0f}")
+    if compact:
+        print(f"  total:       {full:>8.0f} -> {compact:>8.0f}  ({full / compact:.1f}x smaller)")
+
+def recall_report(conn, config, queries, weight, k):
+    """
+    Compares the two-stage (compact + re-rank) ranking with the exact full-vector
+    ranking and prints recall@k per query.
+    """
+    import vertexai
+    from vertexai.language_models import TextEmbeddingModel
+    from vertexai.vision_models import MultiModalEmbeddingModel
+
+    vertexai.init(
+        project=os.getenv("GCP_PROJECT_ID") or os.environ.get("GOOGLE_CLOUD_PROJECT"),
+        location=os.getenv("GCP_LOCATION", "europe-west1"),
+    )
+    text_model = TextEmbeddingModel.from_pretrained("gemini-embedding-001")
+    mm_model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding")
+
+    cursor = conn.cursor()
+    print(f"\n🎯 Recall@{k} (precision={config.precision}, text={config.text_dim}, "
+          f"image={config.image_dim}, shortlist={config.shortlist_size}, weight={weight})")
+    recalls = []
+    for query in queries:
+        text_vector = str(text_model.get_embeddings([query])[0].values)
+        image_vector = str(mm_model.get_embeddings(contextual_text=query, dimension=1408).text_embedding)
+
+        cursor.execute(f"""
+            SELECT id FROM "search".property_listings
+            ORDER BY {full_score_expr(weight, text_vector, image_vector)} DESC
+            LIMIT {k}
+        """)
+        exact = {row[0] for row in cursor.fetchall()}
+
+        cursor.execute(search_settings_sql(config))
+        cursor.execute(two_stage_search_sql(config, weight, text_vector, image_vector, limit=k))
+        approx = {row[0] for row in cursor.fetchall()}
+
+        recall = len(exact & approx) / len(exact) if exact else 1.0
+        recalls.append(recall)
+        print(f"  {recall:6.1%}  {query}")
+    cursor.close()
+
+    if recalls:
+        print(f"  ------\n  {sum(recalls) / len(recalls):6.1%}  mean")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compact shadow embeddings: schema setup, backfill and recall report. "
+                    "Dimensions/precision come from COMPACT_* variables in backend/.env."
+    )
+    parser.add_argument("command", choices=["setup", "backfill", "report", "all"])
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per backfill batch")
+    parser.add_argument("--query", action="append", help="Recall report query (repeatable)")
+    parser.add_argument("--weight", type=float, default=0.6, help="Text vs. image weight, as in the UI")
+    parser.add_argument("--k", type=int, default=20, help="Result size compared in the recall report")
+    args = parser.parse_args()
+
+    # Always validate here, even if the backend has the feature switched off
+    config = CompactConfig().load()
+    conn = get_db_connection()
+    try:
+        if args.command in ("setup", "all"):
+            setup(conn, config)
+        if args.command in ("backfill", "all"):
+            backfill(conn, config, args.batch_size)
+        if args.command in ("report", "all"):
+            storage_report(conn)
+            recall_report(conn, config, args.query or DEFAULT_QUERIES, args.weight, args.k)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# backend/compact_embeddings.py
+"""
+Compact "shadow" embeddings for two-stage semantic search.
+
+The full-precision columns (`description_embedding` VECTOR(3072) and
+`image_embedding` VECTOR(1408)) are ~18 KB per row. This module describes an
+optional compact copy of each vector:
+
+  * TRUNCATED: only the first N dimensions are kept (Matryoshka-style).
+    `gemini-embedding-001` is trained for this; the multimodal model is not,
+    so check the recall report before shrinking the image vector aggressively.
+  * QUANTIZED: stored as `halfvec` (float16) or `bit` (binary, 1 bit per dim).
+    pgvector has no int8 vector type, so `bit` is the "cheapest" option here.
+
+Semantic search then runs a cheap first pass over the compact columns (one
+HNSW index scan per column) and an exact re-rank on the full vectors for the
+union of both candidate lists only.
+
+Everything is driven by environment variables so the backend, the backfill
+script ("alloydb artefacts/backfill_compact_embeddings.py") and the database
+schema stay in agreement:
+
+  COMPACT_EMBEDDINGS_ENABLED   'true' to use the two-stage query (default: false)
+  COMPACT_TEXT_DIM             Dimensions kept from description_embedding (default: 768)
+  COMPACT_IMAGE_DIM            Dimensions kept from image_embedding (default: 512)
+  COMPACT_EMBEDDING_PRECISION  'float32' | 'float16' | 'binary' (default: float16)
+  COMPACT_SHORTLIST_SIZE       Nearest neighbours fetched per column for the re-rank (default: 100)
+"""
+import os
+
+TEXT_FULL_DIM = 3072
+IMAGE_FULL_DIM = 1408
+
+# pgvector caps hnsw.ef_search (and therefore the rows one HNSW scan can return) at 1000.
+HNSW_MAX_EF_SEARCH = 1000
+
+# precision -> (pgvector type, distance operator, HNSW operator class, max HNSW dimensions)
+PRECISIONS = {
+    "float32": ("vector", "<=>", "vector_cosine_ops", 2000),
+    "float16": ("halfvec", "<=>", "halfvec_cosine_ops", 4000),
+    "binary": ("bit", "<~>", "bit_hamming_ops", 64000),
+}
+
+TEXT_COLUMN = "description_embedding_compact"
+IMAGE_COLUMN = "image_embedding_compact"
+
+
+class CompactConfig:
+    """
+    Compact embedding settings, read from the environment.
+    The COMPACT_* values are only parsed and validated when the feature is
+    enabled (or `load()` is called explicitly), so a stray value cannot stop
+    the backend from starting while the feature is off.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("COMPACT_EMBEDDINGS_ENABLED", "false").lower() == "true"
+        if self.enabled:
+            self.load()
+
+    def load(self):
+        """Parses and validates the COMPACT_* variables. Raises ValueError on bad values."""
+        self.text_dim = int(os.getenv("COMPACT_TEXT_DIM", "768"))
+        self.image_dim = int(os.getenv("COMPACT_IMAGE_DIM", "512"))
+        self.precision = os.getenv("COMPACT_EMBEDDING_PRECISION", "float16").lower()
+        self.shortlist_size = int(os.getenv("COMPACT_SHORTLIST_SIZE", "100"))
+
+        if self.precision not in PRECISIONS:
+            raise ValueError(
+                f"COMPACT_EMBEDDING_PRECISION must be one of {sorted(PRECISIONS)}, got '{self.precision}'"
+            )
+        # Bounded by the source vector and by what an HNSW index on the type supports.
+        max_index_dim = PRECISIONS[self.precision][3]
+        max_text_dim = min(TEXT_FULL_DIM, max_index_dim)
+        max_image_dim = min(IMAGE_FULL_DIM, max_index_dim)
+        if not 0 < self.text_dim <= max_text_dim:
+            raise ValueError(
+                f"COMPACT_TEXT_DIM must be between 1 and {max_text_dim} for precision '{self.precision}'"
+            )
+        if not 0 < self.image_dim <= max_image_dim:
+            raise ValueError(
+                f"COMPACT_IMAGE_DIM must be between 1 and {max_image_dim} for precision '{self.precision}'"
+            )
+        if not 0 < self.shortlist_size <= HNSW_MAX_EF_SEARCH:
+            raise ValueError(f"COMPACT_SHORTLIST_SIZE must be between 1 and {HNSW_MAX_EF_SEARCH}")
+        return self
+
+    @property
+    def pg_type(self):
+        return PRECISIONS[self.precision][0]
+
+    def column_type(self, dim):
+        return f"{self.pg_type}({dim})"
+
+    def compact_expr(self, source, dim):
+        """SQL expression turning a full vector expression into its compact form."""
+        truncated = f"subvector({source}, 1, {dim})"
+        if self.precision == "binary":
+            return f"binary_quantize({truncated})::bit({dim})"
+        return f"{truncated}::{self.column_type(dim)}"
+
+    def distance_expr(self, column, literal, dim):
+        """
+        SQL distance (lower is better) between a compact column and a
+        full-dimension query vector literal. Written as `column <op> value` so
+        ORDER BY ... LIMIT can be served by the column's HNSW index.
+        """
+        operator = PRECISIONS[self.precision][1]
+        query = self.compact_expr(f"'{literal}'::vector", dim)
+        return f"{column} {operator} {query}"
+
+
+# ==============================================================================
+# SCHEMA (DDL)
+# ==============================================================================
+
+def setup_statements(config):
+    """
+    DDL for the shadow columns, the sync trigger and the first-pass indexes.
+    Safe to re-run: a column is only dropped (and must be backfilled again) when
+    its type no longer matches the configured dimensions / precision.
+    """
+    opclass = PRECISIONS[config.precision][2]
+    text_type = config.column_type(config.text_dim)
+    image_type = config.column_type(config.image_dim)
+
+    return [
+        'CREATE EXTENSION IF NOT EXISTS vector CASCADE',
+        # Recreate only if the configured type differs from what is already there.
+        _drop_if_type_differs(TEXT_COLUMN, text_type),
+        _drop_if_type_differs(IMAGE_COLUMN, image_type),
+        f'ALTER TABLE "search".property_listings ADD COLUMN IF NOT EXISTS {TEXT_COLUMN} {text_type}',
+        f'ALTER TABLE "search".property_listings ADD COLUMN IF NOT EXISTS {IMAGE_COLUMN} {image_type}',
+        # Keep shadow columns in sync on write.
+        # AFTER trigger: 'description_embedding' is a generated column and is only
+        # computed after BEFORE triggers have run. The inner UPDATE touches only
+        # the compact columns, so it does not re-fire this trigger.
+        f"""
+        CREATE OR REPLACE FUNCTION "search".sync_compact_embeddings() RETURNS trigger AS $$
+        BEGIN
+            UPDATE "search".property_listings
+            SET {TEXT_COLUMN} = {config.compact_expr('NEW.description_embedding', config.text_dim)},
+                {IMAGE_COLUMN} = {config.compact_expr('NEW.image_embedding', config.image_dim)}
+            WHERE id = NEW.id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS trg_sync_compact_embeddings ON "search".property_listings',
+        """
+        CREATE TRIGGER trg_sync_compact_embeddings
+        AFTER INSERT OR UPDATE OF description, image_embedding ON "search".property_listings
+        FOR EACH ROW EXECUTE FUNCTION "search".sync_compact_embeddings()
+        """,
+        # HNSW (pgvector) supports halfvec/bit. Each index serves one half of the
+        # first-pass shortlist in two_stage_search_sql(). Dropping a column above
+        # also drops its index, so these are rebuilt with the new operator class.
+        f'CREATE INDEX IF NOT EXISTS idx_hnsw_property_desc_compact ON "search".property_listings '
+        f'USING hnsw ({TEXT_COLUMN} {opclass})',
+        f'CREATE INDEX IF NOT EXISTS idx_hnsw_image_compact ON "search".property_listings '
+        f'USING hnsw ({IMAGE_COLUMN} {opclass})',
+    ]
+
+
+def _drop_if_type_differs(column, column_type):
+    """DO block dropping `column` only when it exists with a different type."""
+    return f"""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = '"search".property_listings'::regclass
+                  AND attname = '{column}'
+                  AND NOT attisdropped
+                  AND format_type(atttypid, atttypmod) <> '{column_type}'
+            ) THEN
+                ALTER TABLE "search".property_listings DROP COLUMN {column};
+            END IF;
+        END
+        $$
+        """
+
+
+def backfill_statement(config):
+    """Populates one batch of missing shadow vectors. Params: (last_id, batch_size)."""
+    return f"""
+    WITH batch AS (
+        SELECT id FROM "search".property_listings
+        WHERE id > %s
+          AND (({TEXT_COLUMN} IS NULL AND description_embedding IS NOT NULL)
+            OR ({IMAGE_COLUMN} IS NULL AND image_embedding IS NOT NULL))
+        ORDER BY id
+        LIMIT %s
+    )
+    UPDATE "search".property_listings p
+    SET {TEXT_COLUMN} = {config.compact_expr('p.description_embedding', config.text_dim)},
+        {IMAGE_COLUMN} = {config.compact_expr('p.image_embedding', config.image_dim)}
+    FROM batch
+    WHERE p.id = batch.id
+    RETURNING p.id
+    """
+
+
+# ==============================================================================
+# SEARCH
+# ==============================================================================
+
+def full_score_expr(weight, text_vector, image_vector, prefix=""):
+    """Exact weighted similarity on the full-precision columns."""
+    return f"""(
+                ({weight} * (1 - ({prefix}"description_embedding" <=> '{text_vector}'))) +
+                ((1 - {weight}) * (1 - ({prefix}"image_embedding" <=> '{image_vector}')))
+              )"""
+
+
+def search_settings_sql(config):
+    """
+    Session setting for the first pass. An HNSW scan returns at most
+    `hnsw.ef_search` rows (default 40), so it must cover the shortlist size.
+    Run inside the same transaction as two_stage_search_sql().
+    """
+    return f"SET LOCAL hnsw.ef_search = {max(40, config.shortlist_size)}"
+
+
+def two_stage_search_sql(config, weight, text_vector, image_vector, limit=20):
+    """
+    Stage 1: the nearest `shortlist_size` rows by compact text vector and by
+             compact image vector (one HNSW index scan each), unioned.
+    Stage 2: re-rank only that union with the exact weighted full-vector formula.
+    """
+    text_dist = config.distance_expr(TEXT_COLUMN, text_vector, config.text_dim)
+    image_dist = config.distance_expr(IMAGE_COLUMN, image_vector, config.image_dim)
+    return f"""
+            WITH text_candidates AS (
+              SELECT id
+              FROM "search".property_listings
+              ORDER BY {text_dist}
+              LIMIT {config.shortlist_size}
+            ),
+            image_candidates AS (
+              SELECT id
+              FROM "search".property_listings
+              ORDER BY {image_dist}
+              LIMIT {config.shortlist_size}
+            ),
+            shortlist AS (
+              SELECT id FROM text_candidates
+              UNION
+              SELECT id FROM image_candidates
+            )
+            SELECT p.id, p.title, p.description, p.price, p.city, p.bedrooms, p.image_gcs_uri
+            FROM "search".property_listings p
+            JOIN shortlist s ON s.id = p.id
+            ORDER BY
+              {full_score_expr(weight, text_vector, image_vector, prefix="p.")} DESC
+            LIMIT {limit};
+            """
@@ -1,6 +1,5 @@
 # backend/main.py
 import os
-import re
 import base64
 import psycopg2
 import vertexai
@@ -14,6 +13,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from google.cloud import storage
+from compact_embeddings import CompactConfig, full_score_expr, search_settings_sql, two_stage_search_sql
+from sql_guard import GuardConfig, SQLGuardError, execute_guarded
 
 # ... (imports remain same)
 
@@ -76,6 +77,16 @@ except Exception as e:
     print(f"Warning: Google Cloud initialization failed. AI features may not work.\nError: {e}")
     # The variables remain None if initialization failed
 
+# Optional compact (truncated/quantized) shadow embeddings for semantic search.
+# See compact_embeddings.py and "alloydb artefacts/backfill_compact_embeddings.py".
+compact_config = CompactConfig()
+if compact_config.enabled:
+    print(f"Compact embeddings enabled: text={compact_config.text_dim}, image={compact_config.image_dim}, "
+          f"precision={compact_config.precision}, shortlist={compact_config.shortlist_size}")
+
+# Limits applied to AI-generated SQL in NL2SQL mode. See sql_guard.py.
+guard_config = GuardConfig()
+
 
 # ... (Data Models remain same)
 
@@ -255,14 +266,16 @@ async def search_properties(request: SearchRequest, raw_request: Request):
             # 3. Build SQL with the weighted formula
             # Formula: (weight * (1 - text_dist)) + ((1-weight) * (1 - image_dist))
             # We use <=> (cosine distance). Similarity = 1 - Distance.
-            sql = f"""
+            if compact_config.enabled:
+                # Two-stage: cheap first pass on compact vectors, exact re-rank on the shortlist.
+                cursor.execute(search_settings_sql(compact_config))
+                sql = two_stage_search_sql(compact_config, request.weight, text_vector, image_vector)
+            else:
+                sql = f"""
             SELECT id, title, description, price, city, bedrooms, image_gcs_uri
             FROM "search".property_listings 
             ORDER BY 
-              (
-                ({request.weight} * (1 - ("description_embedding" <=> '{text_vector}'))) + 
-                ((1 - {request.weight}) * (1 - ("image_embedding" <=> '{image_vector}')))
-              ) DESC
+              {full_score_expr(request.weight, text_vector, image_vector)} DESC
             LIMIT 20;
             """
             
@@ -276,6 +289,11 @@ ORDER BY
     ({round(1 - request.weight, 1)} * (1 - ("image_embedding" <=> '[{image_vector[1:20]}...]')))
   ) DESC
 LIMIT 20;"""
+            if compact_config.enabled:
+                display_sql = f"""// Stage 1: top {compact_config.shortlist_size} by text + top {compact_config.shortlist_size} by image on compact {compact_config.precision} vectors
+//   (description: {compact_config.text_dim} dims, image: {compact_config.image_dim} dims)
+// Stage 2: exact re-rank of the shortlist on full vectors
+""" + display_sql
            
             cursor.execute(sql)
             
@@ -297,22 +315,22 @@ LIMIT 20;"""
             if not gen_sql: 
                 return {"listings": [], "sql": "Could not generate SQL from query."}
 
-            # SQL cleanup heuristics for demo purposes
-            # SECURITY WARNING: This executes AI-generated SQL directly against the database.
-            # In a production environment, you MUST:
-            # 1. Use a read-only database user with strictly limited permissions.
-            # 2. Implement a validation layer to parse and allow-list SQL structures.
-            # 3. Never expose this endpoint publicly without authentication and rate limiting.
-            gen_sql = gen_sql.strip().rstrip(';')
-            if "FROM" in gen_sql.upper():
-                gen_sql = gen_sql.replace("SELECT ", "SELECT image_gcs_uri, ", 1)
-            
-            final_sql = re.sub(r"LIMIT\s+\d+", "LIMIT 20", gen_sql, flags=re.IGNORECASE)
-            if "LIMIT" not in final_sql.upper(): 
-                final_sql += " LIMIT 20"
-            
+            # SECURITY: This executes AI-generated SQL against the database.
+            # The guard parses it and only allows a single read-only SELECT, injects
+            # 'image_gcs_uri' and a LIMIT, checks the EXPLAIN estimate and runs it in a
+            # read-only transaction with a statement timeout.
+            # In a production environment you should still use a read-only database user
+            # and never expose this endpoint publicly without authentication and rate limiting.
+            try:
+                final_sql = execute_guarded(conn, cursor, gen_sql, guard_config)
+            except SQLGuardError as e:
+                # Same fallback as an empty result: let the UI suggest known cities
+                conn.rollback()
+                cursor.execute('SELECT DISTINCT city FROM "search".property_listings ORDER BY city')
+                cities = [row[0] for row in cursor.fetchall()]
+                return {"listings": [], "sql": f"// Query rejected by SQL guard: {e}\n{gen_sql}", "available_cities": cities}
+
             display_sql = final_sql
-            cursor.execute(final_sql)
             
             if cursor.description:
                 columns = [desc[0] for desc in cursor.description]
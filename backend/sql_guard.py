@@ -0,0 +1,238 @@
+# backend/sql_guard.py
+"""
+Guarded execution of AI-generated SQL (NL2SQL mode).
+
+The SQL returned by `alloydb_ai_nl.get_sql` is untrusted. Before it runs it is:
+
+  1. PARSED into an AST (sqlglot, PostgreSQL + pgvector dialect) and rejected unless it is
+     a single, read-only SELECT.
+  2. REWRITTEN structurally: `image_gcs_uri` is appended to the projection when
+     `property_listings` is read directly, and the LIMIT is capped (instead of
+     string replacements / regexes).
+  3. EXPLAINED: the planner's estimated cost and result row count are checked
+     against configurable thresholds before the real query is executed. Plans
+     over a threshold are rejected and logged; no plan rewrite is attempted
+     (the LIMIT cap in step 2 is applied to every query, before EXPLAIN).
+  4. EXECUTED in a read-only transaction with a statement timeout.
+
+Thresholds are read from the environment:
+
+  NL2SQL_RESULT_LIMIT           Maximum rows returned (default: 20)
+  NL2SQL_STATEMENT_TIMEOUT_MS   Per-query statement timeout (default: 5000)
+  NL2SQL_MAX_PLAN_COST          Maximum estimated total plan cost (default: 100000)
+  NL2SQL_MAX_PLAN_ROWS          Maximum estimated rows of the query result (default: 1000)
+
+The row check looks at the top-level result only, so full scans under a LIMIT
+are not rejected because of table size; expensive scans are caught by the cost
+check. With the LIMIT cap in place it acts as a backstop.
+"""
+import os
+import json
+import sqlglot
+from sqlglot import exp
+from sqlglot.dialects.postgres import Postgres
+from sqlglot.tokens import TokenType
+
+REQUIRED_COLUMN = "image_gcs_uri"
+REQUIRED_COLUMN_TABLE = "property_listings"
+
+# pgvector distance operators: L2, cosine, negative inner product, L1, Hamming.
+PGVECTOR_OPERATORS = ("<->", "<=>", "<#>", "<+>", "<~>")
+
+# Node types that must never appear anywhere in a generated query.
+FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop,
+    exp.Alter, exp.Command, exp.Into, exp.Lock, exp.Set, exp.Transaction,
+)
+
+
+class SQLGuardError(Exception):
+    """Raised when generated SQL is rejected by the guard."""
+
+
+class GuardConfig:
+    """NL2SQL guard thresholds, read from the environment."""
+
+    def __init__(self):
+        self.result_limit = int(os.getenv("NL2SQL_RESULT_LIMIT", "20"))
+        self.statement_timeout_ms = int(os.getenv("NL2SQL_STATEMENT_TIMEOUT_MS", "5000"))
+        self.max_plan_cost = float(os.getenv("NL2SQL_MAX_PLAN_COST", "100000"))
+        self.max_plan_rows = float(os.getenv("NL2SQL_MAX_PLAN_ROWS", "1000"))
+
+
+# ==============================================================================
+# DIALECT
+# ==============================================================================
+# Stock sqlglot reads `<=>` as MySQL's null-safe equality (and writes it back as
+# IS NOT DISTINCT FROM) and cannot tokenize `<#>`, `<+>` or `<~>`. This dialect
+# parses all pgvector operators into VectorDistance and writes them back verbatim.
+
+class VectorDistance(exp.Operator):
+    """A pgvector distance operator; `operator` holds its literal text."""
+
+
+def _parse_vector_distance(self, this):
+    # Parsed at "range" level: tighter than comparisons, looser than + - * /,
+    # which matches PostgreSQL's precedence for user-defined operators.
+    return self.expression(
+        VectorDistance(this=this, operator=self._prev.text, expression=self._parse_bitwise())
+    )
+
+
+class PgVectorPostgres(Postgres):
+    class Tokenizer(Postgres.Tokenizer):
+        # Postgres has no null-safe equality operator, so its token type is free
+        # to carry every pgvector operator (the text tells them apart).
+        KEYWORDS = {
+            **Postgres.Tokenizer.KEYWORDS,
+            **{op: TokenType.NULLSAFE_EQ for op in PGVECTOR_OPERATORS},
+        }
+
+    class Parser(Postgres.Parser):
+        EQUALITY = {k: v for k, v in Postgres.Parser.EQUALITY.items() if k != TokenType.NULLSAFE_EQ}
+        RANGE_PARSERS = {**Postgres.Parser.RANGE_PARSERS, TokenType.NULLSAFE_EQ: _parse_vector_distance}
+
+    class Generator(Postgres.Generator):
+        TRANSFORMS = {
+            **Postgres.Generator.TRANSFORMS,
+            VectorDistance: lambda self, e: (
+                f"{self.sql(e, 'this')} {e.text('operator')} {self.sql(e, 'expression')}"
+            ),
+        }
+
+
+# ==============================================================================
+# PARSE & REWRITE
+# ==============================================================================
+
+def prepare_sql(gen_sql, config):
+    """
+    Validates the generated SQL and returns the rewritten query string.
+    Raises SQLGuardError if it is not a single read-only SELECT.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(gen_sql, read=PgVectorPostgres) if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLGuardError(f"Could not parse generated SQL: {e}")
+
+    if len(statements) != 1:
+        raise SQLGuardError(f"Expected exactly one statement, got {len(statements)}")
+
+    query = statements[0]
+    if not isinstance(query, exp.Select):
+        raise SQLGuardError(f"Only SELECT statements are allowed, got {query.key.upper()}")
+
+    forbidden = next(query.find_all(*FORBIDDEN_NODES), None)
+    if forbidden is not None:
+        raise SQLGuardError(f"Forbidden construct in generated SQL: {forbidden.key.upper()}")
+
+    _inject_required_column(query)
+    _cap_limit(query, config.result_limit)
+
+    return query.sql(dialect=PgVectorPostgres)
+
+
+def _inject_required_column(query):
+    """
+    The frontend needs `image_gcs_uri` to render listing cards. It is only added
+    when it cannot change the query's meaning or make it invalid: appended (so
+    positional ORDER BY / GROUP BY references are unaffected) and qualified with
+    the alias of the single `property_listings` table read directly in FROM/JOIN.
+    """
+    # Adding a column to a DISTINCT, aggregate or grouped query would change its meaning.
+    if query.args.get("distinct") or query.args.get("group") or query.args.get("having"):
+        return
+    if any(e.find(exp.AggFunc) for e in query.expressions):
+        return
+    for projection in query.expressions:
+        if isinstance(projection, exp.Star) or projection.alias_or_name == REQUIRED_COLUMN:
+            return
+        if isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star):
+            return  # e.g. "p.*"
+
+    table = _listings_table(query)
+    if table is None:
+        return
+    query.select(exp.column(REQUIRED_COLUMN, table=table.alias_or_name), append=True, copy=False)
+
+
+def _listings_table(query):
+    """
+    The `property_listings` table read directly by this SELECT, or None if it is
+    absent, read more than once, or shadowed by a CTE of the same name.
+    """
+    from_ = next((arg for arg in query.args.values() if isinstance(arg, exp.From)), None)
+    if from_ is None:
+        return None
+    cte_names = {cte.alias_or_name for cte in query.find_all(exp.CTE)}
+    if REQUIRED_COLUMN_TABLE in cte_names:
+        return None
+
+    sources = [from_.this] + [join.this for join in query.args.get("joins") or []]
+    tables = [t for t in sources if isinstance(t, exp.Table) and t.name == REQUIRED_COLUMN_TABLE]
+    return tables[0] if len(tables) == 1 else None
+
+
+def _cap_limit(query, max_rows):
+    """Keeps a smaller literal LIMIT from the model, otherwise enforces `max_rows`."""
+    limit = query.args.get("limit")
+    current = limit.expression if limit else None
+    if isinstance(current, exp.Literal) and current.is_int and int(current.this) <= max_rows:
+        return
+    query.limit(max_rows, copy=False)
+
+
+# ==============================================================================
+# EXPLAIN & EXECUTE
+# ==============================================================================
+
+def _plan_estimates(plan):
+    """Top-level total cost and estimated result rows of the plan."""
+    return float(plan.get("Total Cost", 0)), float(plan.get("Plan Rows", 0))
+
+
+def check_plan(cursor, sql, config):
+    """
+    Runs EXPLAIN (no execution) and rejects plans above the configured thresholds.
+    Returns (estimated_cost, estimated_rows).
+    """
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+    explain = cursor.fetchone()[0]
+    if isinstance(explain, str):
+        explain = json.loads(explain)
+    cost, rows = _plan_estimates(explain[0]["Plan"])
+
+    print(f"[SQL Guard] Estimated cost={cost:.0f} rows={rows:.0f} "
+          f"(limits: cost={config.max_plan_cost:.0f}, rows={config.max_plan_rows:.0f})")
+    if cost > config.max_plan_cost:
+        raise SQLGuardError(f"Estimated plan cost {cost:.0f} exceeds limit {config.max_plan_cost:.0f}")
+    if rows > config.max_plan_rows:
+        raise SQLGuardError(f"Estimated row count {rows:.0f} exceeds limit {config.max_plan_rows:.0f}")
+    return cost, rows
+
+
+def execute_guarded(conn, cursor, gen_sql, config):
+    """
+    Full pipeline: parse/rewrite, open a read-only transaction with a statement
+    timeout, EXPLAIN, then execute. Returns the SQL that was executed.
+    The cursor holds the result set afterwards.
+    """
+    try:
+        sql = prepare_sql(gen_sql, config)
+    except SQLGuardError as e:
+        print(f"[SQL Guard] Rejected: {e}\n  SQL: {gen_sql}")
+        raise
+
+    # Start a fresh transaction so the limits below apply to everything that follows.
+    conn.commit()
+    cursor.execute("SET TRANSACTION READ ONLY")
+    cursor.execute("SET LOCAL statement_timeout = %s", (config.statement_timeout_ms,))
+
+    try:
+        check_plan(cursor, sql, config)
+    except SQLGuardError as e:
+        print(f"[SQL Guard] Rejected: {e}\n  SQL: {sql}")
+        raise
+
+    cursor.execute(sql)
+    return sql